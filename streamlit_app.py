@@ -1,6 +1,13 @@
+import os
+import uuid
+from collections import namedtuple
+
 import streamlit as st
+import numpy as np
 import pandas as pd
-import altair as alt
+import pyarrow as pa
+import pyarrow.csv as pv
+import pyarrow.parquet as pq
 
 # -----------------------------------------------------------------------------
 # 1. PAGE CONFIG
@@ -14,22 +21,200 @@ st.set_page_config(
 # -----------------------------------------------------------------------------
 # 2. DATA LOADING
 # -----------------------------------------------------------------------------
-@st.cache_data
-def load_data():
+METRICS_CSV  = "data/metrics_data_new.csv"
+RELEASES_CSV = "data/release_data_new.csv"
+
+# the per-row counts every metric is built from
+COUNT_COLS = ["active_sessions","fd_tickets","feedback_given","happy"]
+
+# the only metrics columns the app reads
+METRICS_COLS = ["date_"] + COUNT_COLS
+
+# explicit column types, applied by the csv parser itself
+CATEGORY = pa.dictionary(pa.int32(), pa.string())
+
+METRICS_TYPES = {"date_": pa.timestamp("ns"), **{col: pa.int32() for col in COUNT_COLS}}
+RELEASES_TYPES = {
+    "updated":    pa.timestamp("ns"),
+    "created":    pa.timestamp("ns"),
+    "status":     CATEGORY,
+    "issue_type": CATEGORY,
+}
+
+def to_frame(table):
+    # text columns as arrow-backed strings, not python objects
+    return table.to_pandas(
+        types_mapper=lambda typ: pd.StringDtype("pyarrow") if typ == pa.string() else None
+    )
+
+def csv_stamp(csv_path):
+    # identifies the exact csv a sidecar was written from
+    stat = os.stat(csv_path)
+    return {b"csv_mtime_ns": str(stat.st_mtime_ns).encode(), b"csv_size": str(stat.st_size).encode()}
+
+def sidecar_is_fresh(pq_path, csv_path, column_types, columns=None):
+    # written from this exact csv, with the columns and types asked for
+    if not os.path.exists(pq_path):
+        return False
+    try:
+        schema = pq.read_schema(pq_path)
+    except (pa.ArrowInvalid, OSError):
+        return False  # truncated / unreadable sidecar: re-parse the csv
+    metadata = schema.metadata or {}
+    if any(metadata.get(key) != value for key, value in csv_stamp(csv_path).items()):
+        return False
+    return all(col in schema.names for col in columns or []) and all(
+        col in schema.names and schema.field(col).type == typ
+        for col, typ in column_types.items()
+    )
+
+def write_sidecar(table, pq_path, stamp):
+    # temp file + rename, so a failed write never leaves a partial sidecar
+    tmp_path = f"{pq_path}.{uuid.uuid4().hex}.tmp"
+    try:
+        pq.write_table(table.replace_schema_metadata(stamp), tmp_path, compression="zstd")
+        os.replace(tmp_path, pq_path)
+    except OSError:
+        # read-only data dir: fall back to parsing the csv every cold start
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def read_csv_cached(csv_path, column_types, columns=None):
+    # parse the csv with pyarrow once and keep it as a parquet sidecar
+    pq_path = os.path.splitext(csv_path)[0] + ".parquet"
+    if sidecar_is_fresh(pq_path, csv_path, column_types, columns):
+        try:
+            return to_frame(pq.read_table(pq_path, columns=columns))
+        except (pa.ArrowInvalid, OSError):
+            pass  # corrupt sidecar: re-parse the csv and rewrite it
+
+    stamp = csv_stamp(csv_path)
+    table = pv.read_csv(
+        csv_path,
+        convert_options=pv.ConvertOptions(
+            column_types=column_types,
+            include_columns=columns or []
+        )
+    )
+    write_sidecar(table, pq_path, stamp)
+    return to_frame(table)
+
+def data_version():
+    # cache key for everything derived from the csvs
+    return os.stat(METRICS_CSV).st_mtime, os.stat(RELEASES_CSV).st_mtime
+
+# one data version at a time
+@st.cache_data(max_entries=1)
+def load_data(version):
     # Assumes data/metrics_data_new.csv and data/release_data_new.csv exist
-    metrics = pd.read_csv("data/metrics_data_new.csv", parse_dates=["date_"])
-    releases = pd.read_csv("data/release_data_new.csv", parse_dates=["updated", "created"])
+    metrics = read_csv_cached(METRICS_CSV, METRICS_TYPES, columns=METRICS_COLS)
+    releases = read_csv_cached(RELEASES_CSV, RELEASES_TYPES)
     return metrics, releases
 
-metrics_df, releases_df = load_data()
-
 # -----------------------------------------------------------------------------
-# 3. DERIVED METRICS (as percentages)
+# 3. DERIVED METRICS (as percentages) & PRE-AGGREGATION
 # -----------------------------------------------------------------------------
-metrics_df = metrics_df.assign(
-    ticket_rate = metrics_df["fd_tickets"]    / metrics_df["active_sessions"] * 100,
-    msat        = metrics_df["happy"]         / metrics_df["feedback_given"]   * 100
-)
+# everything that differs between granularities
+GranSpec = namedtuple("GranSpec", ["freq", "fmt", "has_end", "lookback"])
+
+GRAN_SPEC = {
+    "Daily":   GranSpec("D",     "%a, %d %b", False, pd.Timedelta(days=14)),
+    "Weekly":  GranSpec("W-SAT", "%b %d",     True,  pd.Timedelta(weeks=5)),
+    "Monthly": GranSpec("M",     "%b %y",     False, pd.DateOffset(months=4)),
+}
+
+def period_label(frame, gran):
+    # format each distinct period once and broadcast the labels back
+    fmt = GRAN_SPEC[gran].fmt
+    starts = frame["period_start"]
+    _, first, inverse = np.unique(starts.to_numpy(), return_index=True, return_inverse=True)
+    label = starts.iloc[first].dt.strftime(fmt)
+    if "period_end" in frame:
+        label = label + " - " + frame["period_end"].iloc[first].dt.strftime(fmt)
+    return pd.Series(label.to_numpy()[inverse], index=starts.index)
+
+def period_bins(dates, gran):
+    # period bounds and display label for each date
+    spec = GRAN_SPEC[gran]
+    days = dates.to_numpy(dtype="datetime64[ns]").astype("datetime64[D]")
+    if spec.freq == "W-SAT":
+        # back to the sunday opening the week (1970-01-01 was a thursday)
+        start = days - (days.view("int64") + 4) % 7
+    elif spec.freq == "M":
+        start = days.astype("datetime64[M]")
+    else:
+        start = days
+
+    def as_series(values):
+        return pd.Series(values.astype("datetime64[ns]"), index=dates.index)
+
+    bins = {"period_start": as_series(start)}
+    if spec.has_end:
+        # the saturday that closes the week
+        bins["period_end"] = as_series(start + 6)
+    bins["time"] = period_label(bins, gran)
+    return bins
+
+@st.cache_data(max_entries=1)
+def daily_metrics(version):
+    metrics, _ = load_data(version)
+
+    # per-row rates, in a narrow frame with just the columns reduced below
+    def rate(num, den):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            out = np.divide(metrics[num].to_numpy(), metrics[den].to_numpy(), dtype="float64")
+        out *= 100
+        return out
+
+    rates = pd.DataFrame({
+        "date_":           metrics["date_"],
+        "ticket_rate":     rate("fd_tickets", "active_sessions"),
+        "msat":            rate("happy",      "feedback_given"),
+        "active_sessions": metrics["active_sessions"],
+        "fd_tickets":      metrics["fd_tickets"],
+        "feedback_given":  metrics["feedback_given"],
+        "happy":           metrics["happy"],
+    })
+
+    # one row per day: rate sums & counts plus the volume totals
+    daily = rates.groupby("date_", as_index=False).agg(
+        ticket_rate_sum=("ticket_rate","sum"),
+        ticket_rate_n  =("ticket_rate","count"),
+        msat_sum       =("msat","sum"),
+        msat_n         =("msat","count"),
+        active_sessions=("active_sessions","sum"),
+        fd_tickets     =("fd_tickets","sum"),
+        feedback_given =("feedback_given","sum"),
+        happy          =("happy","sum")
+    )
+    return daily
+
+# binned frames, cached per granularity
+@st.cache_data(max_entries=len(GRAN_SPEC))
+def metric_partials(version, gran):
+    daily = daily_metrics(version)
+    return daily.assign(**period_bins(daily["date_"], gran))
+
+@st.cache_data(max_entries=len(GRAN_SPEC))
+def release_periods(version, gran):
+    _, releases = load_data(version)
+    # sorted for date_slice
+    releases = releases.sort_values("updated", kind="stable").reset_index(drop=True)
+    return releases.assign(**period_bins(releases["updated"], gran))
+
+@st.cache_data(max_entries=1)
+def date_bounds(version):
+    # sidebar limits
+    metrics, _ = load_data(version)
+    return metrics["date_"].min().date(), metrics["date_"].max().date()
+
+def date_slice(frame, col, start, end):
+    # rows in [start, end + 1 day); frame must be sorted on col
+    lo = frame[col].searchsorted(pd.Timestamp(start), side="left")
+    hi = frame[col].searchsorted(pd.Timestamp(end) + pd.Timedelta(days=1), side="left")
+    return frame.iloc[lo:hi]
+
+version = data_version()
 
 # -----------------------------------------------------------------------------
 # 4. USER CONTROLS
@@ -38,18 +223,12 @@ st.sidebar.header("Controls")
 
 gran = st.sidebar.selectbox(
     "Time Granularity",
-    ["Daily", "Weekly", "Monthly"]
+    list(GRAN_SPEC.keys())
 )
 
-min_date = metrics_df["date_"].min().date()
-max_date = metrics_df["date_"].max().date()
+min_date, max_date = date_bounds(version)
 
-if gran == "Daily":
-    default_start = max_date - pd.Timedelta(days=14)
-elif gran == "Weekly":
-    default_start = max_date - pd.Timedelta(weeks=5)
-else:
-    default_start = (max_date - pd.DateOffset(months=4)).date()
+default_start = (pd.Timestamp(max_date) - GRAN_SPEC[gran].lookback).date()
 
 start_date, end_date = st.sidebar.date_input(
     "Date Range",
@@ -71,206 +250,201 @@ metric_column = metric_options[metric_label]
 # -----------------------------------------------------------------------------
 # 5. AGGREGATION & FORMATTING
 # -----------------------------------------------------------------------------
-df = metrics_df[
-    (metrics_df["date_"] >= pd.to_datetime(start_date)) &
-    (metrics_df["date_"] <= pd.to_datetime(end_date))
-].copy()
-
-if gran == "Daily":
-    df_agg = df.groupby("date_", as_index=False).agg(
-        value=(metric_column, "mean")
-    ).rename(columns={"date_": "period_start"})
-    df_agg["time"] = df_agg["period_start"].dt.strftime("%a, %d %b")
-
-elif gran == "Weekly":
-    df["period_start"] = df["date_"].dt.to_period("W-SAT").apply(lambda p: p.start_time)
-    df["period_end"]   = df["date_"].dt.to_period("W-SAT").apply(lambda p: p.end_time)
-    df_agg = df.groupby(["period_start","period_end"], as_index=False).agg(
-        value=(metric_column, "mean")
-    )
-    df_agg["time"] = (
-        df_agg["period_start"].dt.strftime("%b %d")
-        + " - " +
-        df_agg["period_end"].dt.strftime("%b %d")
-    )
+def pct(values):
+    # "12.34%" labels
+    return np.char.add(np.round(np.asarray(values, dtype="float64"), 2).astype(str), "%")
 
-else:  # Monthly
-    df["period_start"] = df["date_"].dt.to_period("M").apply(lambda p: p.start_time)
-    df_agg = df.groupby("period_start", as_index=False).agg(
-        value=(metric_column, "mean")
+def fmt(s):
+    # custom K/M formatting
+    v = s.to_numpy(dtype="float64")
+    return np.select(
+        [v >= 1e6, v >= 1e3],
+        [np.char.mod("%.1fM", v / 1e6), np.char.mod("%.1fK", v / 1e3)],
+        default=v.astype(np.int64).astype(str)
     )
-    df_agg["time"] = df_agg["period_start"].dt.strftime("%b %y")
 
-# ensure chronological order
-df_agg = df_agg.sort_values("period_start")
+# issue keys listed per release tooltip
+MAX_TOOLTIP_KEYS = 10
+
+# columns sent to the chart
+CHART_METRIC_COLS  = ["time","value","value_label"]
+CHART_RELEASE_COLS = ["time","releases_count","releases_keys"]
+
+def chart_spec(metric_label, axis_order):
+    # layered Vega-Lite spec; data is attached by name
+    x = {"field": "time", "type": "ordinal", "sort": axis_order}
+    x_axis = {
+        **x,
+        "axis": {"labelAngle": 0, "labelAlign": "center", "labelColor": "white", "titleColor": "white"}
+    }
+    return {
+        "width": 800,
+        "height": 400,
+        "background": "#111111",
+        "config": {"view": {"strokeOpacity": 0}},
+        "layer": [
+            # white line + dots
+            {
+                "data": {"name": "metrics"},
+                "mark": {"type": "line", "point": True, "color": "white"},
+                "encoding": {
+                    "x": x_axis,
+                    "y": {
+                        "field": "value",
+                        "type": "quantitative",
+                        "title": metric_label,
+                        "axis": {"labelColor": "white", "titleColor": "white"}
+                    }
+                },
+                "params": [{
+                    "name": "zoom",
+                    "select": {"type": "interval", "encodings": ["x", "y"]},
+                    "bind": "scales"
+                }]
+            },
+            # white labels under each point
+            {
+                "data": {"name": "metrics"},
+                "mark": {"type": "text", "dy": 15, "color": "white"},
+                "encoding": {
+                    "x": x_axis,
+                    "y": {"field": "value", "type": "quantitative"},
+                    "text": {"field": "value_label", "type": "nominal"}
+                }
+            },
+            # neon-blue release markers
+            {
+                "data": {"name": "releases"},
+                "mark": {"type": "rule", "color": "#00FFFF"},
+                "encoding": {"x": x}
+            },
+            {
+                "data": {"name": "releases"},
+                "mark": {"type": "point", "color": "#00FFFF", "size": 100},
+                "encoding": {
+                    "x": x,
+                    "tooltip": [
+                        {"field": "releases_count", "type": "quantitative", "title": "Release Count"},
+                        {"field": "releases_keys",  "type": "nominal",      "title": "Issue Keys"}
+                    ]
+                }
+            }
+        ]
+    }
+
+# regroup the selected days into periods
+days = date_slice(metric_partials(version, gran), "date_", start_date, end_date)
+group_cols = [c for c in ["period_start","period_end"] if c in days]
+
+# one groupby for both the chart and the raw data
+periods = (
+    days
+      .groupby(group_cols, as_index=False, sort=False, observed=True)
+      .agg(
+        time           =("time", "first"),
+        value_sum      =(f"{metric_column}_sum", "sum"),
+        value_n        =(f"{metric_column}_n",   "sum"),
+        active_sessions=("active_sessions","sum"),
+        fd_tickets     =("fd_tickets","sum"),
+        feedback_given =("feedback_given","sum"),
+        happy          =("happy","sum")
+      )
+      # ensure chronological order
+      .sort_values("period_start", ignore_index=True)
+)
+
+df_agg = periods[group_cols + ["time"]].assign(
+    value=periods["value_sum"] / periods["value_n"]
+)
 axis_order = df_agg["time"].tolist()
 
 # label values for display
-if not df_agg.empty:
-    df_agg["value_label"] = df_agg["value"].round(2).astype(str) + "%"
+df_agg["value_label"] = pct(df_agg["value"])
 
 # -----------------------------------------------------------------------------
 # 6. CHARTING (dark mode, white line + neon-blue releases)
 # -----------------------------------------------------------------------------
 st.title("Metrics vs. Releases")
 
-# white line + dots
-line = alt.Chart(df_agg).mark_line(point=True, color="white").encode(
-    x=alt.X(
-        "time:O",
-        sort=axis_order,
-        axis=alt.Axis(labelAngle=0, labelAlign="center", labelColor="white", titleColor="white")
-    ),
-    y=alt.Y(
-        "value:Q",
-        title=metric_label,
-        axis=alt.Axis(labelColor="white", titleColor="white")
-    )
-)
-
-# white labels under each point
-text = alt.Chart(df_agg).mark_text(dy=15, color="white").encode(
-    x=alt.X("time:O", sort=axis_order),
-    y="value:Q",
-    text=alt.Text("value_label:N")
-)
+# nothing to chart
+if df_agg.empty:
+    st.warning("No metric data available for the selected period.")
+    st.stop()
 
 # prepare releases for annotation
-rel_filtered = releases_df[
-    (releases_df["updated"] >= pd.to_datetime(start_date)) &
-    (releases_df["updated"] <= pd.to_datetime(end_date))
-].copy()
-
-if gran == "Daily":
-    rel_filtered["period_start"] = rel_filtered["updated"].dt.normalize()
-elif gran == "Weekly":
-    rel_filtered["period_start"] = rel_filtered["updated"].dt.to_period("W-SAT").apply(lambda p: p.start_time)
-    rel_filtered["period_end"]   = rel_filtered["updated"].dt.to_period("W-SAT").apply(lambda p: p.end_time)
-else:
-    rel_filtered["period_start"] = rel_filtered["updated"].dt.to_period("M").apply(lambda p: p.start_time)
+rel_filtered = date_slice(release_periods(version, gran), "updated", start_date, end_date)
 
 # count & list issue_keys per period
+key_rank = rel_filtered.groupby(group_cols, sort=False, observed=True).cumcount()
 rel_count = (
     rel_filtered
-      .groupby([c for c in ["period_start","period_end"] if c in rel_filtered], dropna=False)
+      .assign(issue_key_sep=np.where(
+          key_rank < MAX_TOOLTIP_KEYS, rel_filtered["issue_key"] + ", ", ""
+      ))
+      .groupby(group_cols, dropna=False, sort=False, observed=True)
       .agg(
+        time          =("time", "first"),
         releases_count=("issue_key", "count"),
-        releases_keys =("issue_key", lambda keys: ", ".join(keys))
+        releases_keys =("issue_key_sep", "sum")
       )
       .reset_index()
 )
-
-# rebuild the display label
-if gran == "Daily":
-    rel_count["time"] = rel_count["period_start"].dt.strftime("%a, %d %b")
-elif gran == "Weekly":
-    rel_count["time"] = (
-        rel_count["period_start"].dt.strftime("%b %d")
-        + " - " +
-        rel_count["period_end"].dt.strftime("%b %d")
-    )
-else:
-    rel_count["time"] = rel_count["period_start"].dt.strftime("%b %y")
-
-rel_count = rel_count.sort_values("period_start")
-
-# neon-blue release markers
-rules = alt.Chart(rel_count).mark_rule(color="#00FFFF").encode(
-    x=alt.X("time:O", sort=axis_order)
-)
-points = alt.Chart(rel_count).mark_point(color="#00FFFF", size=100).encode(
-    x=alt.X("time:O", sort=axis_order),
-    tooltip=[
-        alt.Tooltip("releases_count:Q", title="Release Count"),
-        alt.Tooltip("releases_keys:N",    title="Issue Keys")
-    ]
+rel_count["releases_keys"] = rel_count["releases_keys"].str[:-2].where(
+    rel_count["releases_count"] <= MAX_TOOLTIP_KEYS,
+    rel_count["releases_keys"] + "…"
 )
 
-# combine all layers
-chart = (
-    (line + text + rules + points)
-    .properties(width=800, height=400, background="#111111")
-    .configure_view(strokeOpacity=0)
-    .interactive()
-)
+rel_count = rel_count.sort_values("period_start", ignore_index=True)
 
-if df_agg.empty:
-    st.warning("No metric data available for the selected period.")
-else:
-    st.altair_chart(chart, use_container_width=True)
+spec = chart_spec(metric_label, axis_order)
+spec["datasets"] = {
+    "metrics":  df_agg[CHART_METRIC_COLS],
+    "releases": rel_count[CHART_RELEASE_COLS]
+}
+st.vega_lite_chart(spec=spec, width="stretch")
 
 # -----------------------------------------------------------------------------
 # 7. RAW DATA (Optional)
 # -----------------------------------------------------------------------------
 with st.expander("Show raw aggregated data"):
-    df_metrics = df.copy()
-    if gran == "Daily":
-        df_metrics["period_start"] = df_metrics["date_"].dt.normalize()
-        group_cols = ["period_start"]
-    elif gran == "Weekly":
-        df_metrics["period_start"] = df_metrics["date_"].dt.to_period("W-SAT").apply(lambda p: p.start_time)
-        df_metrics["period_end"]   = df_metrics["date_"].dt.to_period("W-SAT").apply(lambda p: p.end_time)
-        group_cols = ["period_start","period_end"]
-    else:
-        df_metrics["period_start"] = df_metrics["date_"].dt.to_period("M").apply(lambda p: p.start_time)
-        group_cols = ["period_start"]
-
-    agg = (
-        df_metrics
-          .groupby(group_cols, as_index=False)
-          .agg(
-            active_sessions=("active_sessions","sum"),
-            fd_tickets      =("fd_tickets","sum"),
-            feedback_given  =("feedback_given","sum"),
-            happy           =("happy","sum")
-          )
-    )
+    # per-period sums from the chart aggregation
+    periods["MSAT %"] = pct(periods["happy"] / periods["feedback_given"] * 100)
+    periods["Ticket creation %"] = pct(periods["fd_tickets"] / periods["active_sessions"] * 100)
 
-    agg["MSAT %"] = (agg["happy"] / agg["feedback_given"] * 100).round(2).astype(str) + "%"
-    agg["Ticket creation %"] = (agg["fd_tickets"] / agg["active_sessions"] * 100).round(2).astype(str) + "%"
-
-    # attach our formatted time label
-    agg = agg.merge(df_agg[["period_start","time"]], on="period_start", how="left")
-
-    # custom K/M formatting
-    def fmt(x):
-        if x >= 1e6: return f"{x/1e6:.1f}M"
-        if x >= 1e3: return f"{x/1e3:.1f}K"
-        return str(int(x))
-
-    display_df = agg[[
-        "time","active_sessions","fd_tickets","feedback_given","MSAT %","Ticket creation %"
-    ]].copy()
-    display_df["Active sessions"] = display_df["active_sessions"].apply(fmt)
-    display_df["FD Tickets"]      = display_df["fd_tickets"].apply(fmt)
-    display_df["Feedback given"]  = display_df["feedback_given"].apply(fmt)
     display_df = (
-        display_df
-          .drop(columns=["active_sessions","fd_tickets","feedback_given"])
-          .rename(columns={"time":"Time Period"})
+        periods[["time","MSAT %","Ticket creation %"]]
+          .assign(
+            active_sessions=fmt(periods["active_sessions"]),
+            fd_tickets     =fmt(periods["fd_tickets"]),
+            feedback_given =fmt(periods["feedback_given"])
+          )
+          .rename(columns={
+            "time":"Time Period",
+            "active_sessions":"Active sessions",
+            "fd_tickets":"FD Tickets",
+            "feedback_given":"Feedback given"
+          })
     )
     st.dataframe(display_df)
 
 with st.expander("Show release data"):
-    rel_display = rel_filtered.copy()
-    rel_display = rel_display[[
-        "period_start","issue_key","summary","jira_link","issue_type","created"
-    ]]
-    rel_display["Release Date"] = rel_display["period_start"].dt.date
+    rel_display = rel_filtered[[
+        "issue_key","summary","jira_link","issue_type","created"
+    ]].assign(release_date=rel_filtered["period_start"].dt.date)
     rel_display = rel_display.rename(columns={
+        "release_date":"Release Date",
         "issue_key":"JIRA ID",
         "summary":"Summary",
         "jira_link":"JIRA Link",
         "issue_type":"Issue Type",
         "created":"Created On"
     })
-    rel_display["JIRA Link"] = rel_display["JIRA Link"].apply(
-        lambda url: f"<a href='{url}' target='_blank'>{url}</a>"
-    )
     rel_display = rel_display[[
         "Release Date","JIRA ID","Summary","JIRA Link","Issue Type","Created On"
     ]].sort_values("Release Date", ascending=False)
-    st.markdown(
-        rel_display.to_html(index=False, escape=False),
-        unsafe_allow_html=True
+    # clickable jira links
+    st.dataframe(
+        rel_display,
+        hide_index=True,
+        column_config={"JIRA Link": st.column_config.LinkColumn("JIRA Link")}
     )